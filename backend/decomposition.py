@@ -6,20 +6,57 @@ import numpy as np
 import pandas as pd
 from typing import Dict, List, Any, Tuple
 
+from decomp_kernel import decompose_kernel
+
+# Working precision for the decomposition arrays. Betas and residual variances
+# are noisy estimates and the outputs are percentages rounded to 2dp, so
+# float32 loses nothing visible; totals are still accumulated in float64.
+DECOMP_DTYPE = np.float32
+
+# Cross-factor terms below this fraction of total variance are rounding noise
+# at DECOMP_DTYPE precision (a diagonal F measures ≲1 eps), not real covariance
+CROSS_TERM_TOL = 4 * float(np.finfo(DECOMP_DTYPE).eps)
+
+
+# Memoized factor covariances keyed on (frame identity, length, last date, window).
+# Each entry keeps its frame alive and is only a hit for that same object, so a
+# new frame that reuses a collected frame's id() can't pick up a stale matrix.
+_FACTOR_COV_CACHE: Dict[Tuple[Any, ...], Tuple[pd.DataFrame, np.ndarray]] = {}
+_FACTOR_COV_CACHE_SIZE = 8
+
 
 def compute_factor_covariance(ff_df: pd.DataFrame, window: int = 252) -> np.ndarray:
     """
     Compute 3×3 factor covariance matrix from the most recent `window` days
     of Fama-French factor returns.
     Returns numpy array of shape (3, 3) for [Mkt-RF, SMB, HML].
+    Results are memoized per FF frame, so repeated requests against the
+    in-process FF cache skip the pandas work.
     """
+    key = (id(ff_df), len(ff_df), ff_df.index[-1] if len(ff_df) else None, window)
+    entry = _FACTOR_COV_CACHE.get(key)
+    if entry is not None and entry[0] is ff_df:
+        cov = entry[1]
+    else:
+        cov = _compute_factor_covariance_uncached(ff_df, window)
+        _FACTOR_COV_CACHE.pop(key, None)
+        if len(_FACTOR_COV_CACHE) >= _FACTOR_COV_CACHE_SIZE:
+            _FACTOR_COV_CACHE.pop(next(iter(_FACTOR_COV_CACHE)), None)
+        _FACTOR_COV_CACHE[key] = (ff_df, cov)
+    return cov.copy()
+
+
+def _compute_factor_covariance_uncached(ff_df: pd.DataFrame, window: int) -> np.ndarray:
     factor_cols = ["Mkt-RF", "SMB", "HML"]
     recent = ff_df[factor_cols].dropna().tail(window)
 
     if len(recent) < 60:
         raise ValueError(f"Insufficient factor data: only {len(recent)} days available")
 
-    return recent.cov().values  # 3x3 covariance matrix
+    # Sample covariance (ddof=1), computed directly on the 3-column block
+    arr = recent.to_numpy(dtype=np.float64, copy=True)
+    arr -= arr.mean(axis=0)
+    return (arr.T @ arr) / max(arr.shape[0] - 1, 1)  # 3x3 covariance matrix
 
 
 def decompose_portfolio_variance(
@@ -30,6 +67,7 @@ def decompose_portfolio_variance(
 ) -> Dict[str, Any]:
     """
     Decompose total portfolio variance into factor and idiosyncratic components.
+    Dict-based wrapper around decompose_portfolio_variance_arrays.
 
     Parameters:
         weights: {ticker: portfolio_weight} — weights should sum to 1.0
@@ -46,58 +84,82 @@ def decompose_portfolio_variance(
     n = len(tickers)
 
     # Weight vector
-    w = np.array([weights[t] for t in tickers])
+    w = np.fromiter((weights[t] for t in tickers), dtype=np.float64, count=n)
 
-    # B matrix: n_stocks × 3 factor loadings
-    B = np.array([
-        [betas[t]["beta_mkt"], betas[t]["beta_smb"], betas[t]["beta_hml"]]
-        for t in tickers
-    ])
+    # B matrix: n_stocks × 3 factor loadings, filled one column at a time
+    B = np.empty((n, 3), dtype=np.float64)
+    for k, key in enumerate(("beta_mkt", "beta_smb", "beta_hml")):
+        B[:, k] = np.fromiter((betas[t][key] for t in tickers), dtype=np.float64, count=n)
 
-    # D matrix: diagonal of idiosyncratic variances
-    D = np.diag([residual_vars.get(t, 0.0) for t in tickers])
+    # d vector: idiosyncratic variances (the diagonal of D, never materialized)
+    d_vec = np.fromiter(
+        (residual_vars.get(t, 0.0) for t in tickers), dtype=np.float64, count=n
+    )
 
-    # Factor covariance: F is 3×3
-    F = factor_cov
+    return decompose_portfolio_variance_arrays(tickers, w, B, factor_cov, d_vec)
 
-    # Systematic covariance: B·F·Bᵀ (n×n matrix)
-    systematic_cov = B @ F @ B.T
 
-    # Total covariance: Σ = B·F·Bᵀ + D
-    sigma = systematic_cov + D
+def decompose_portfolio_variance_arrays(
+    tickers: List[str],
+    w: np.ndarray,
+    B: np.ndarray,
+    factor_cov: np.ndarray,
+    d_vec: np.ndarray,
+) -> Dict[str, Any]:
+    """
+    Array form of decompose_portfolio_variance, aligned on `tickers`.
+
+    Parameters:
+        tickers: ticker order shared by every array below
+        w: (n,) portfolio weights
+        B: (n, 3) factor loadings [beta_mkt, beta_smb, beta_hml]
+        factor_cov: 3×3 factor covariance matrix
+        d_vec: (n,) residual variances
+
+    Returns the same dict as decompose_portfolio_variance.
+    """
+    weights_out = np.asarray(w, dtype=np.float64)
+    w = np.ascontiguousarray(w, dtype=DECOMP_DTYPE)
+    B = np.ascontiguousarray(B, dtype=DECOMP_DTYPE)
+    d_vec = np.ascontiguousarray(d_vec, dtype=DECOMP_DTYPE)
 
-    # Total portfolio variance: w^T · Σ · w
-    total_var = float(w @ sigma @ w)
+    # Factor covariance: F is 3×3
+    F = np.ascontiguousarray(factor_cov, dtype=DECOMP_DTYPE)
+    fac_vars = np.diag(F).copy()
+
+    # Total portfolio variance: w^T · Σ · w = (w^T·B)·F·(Bᵀ·w) + Σ_i w_i² · d_i
+    # B·F·Bᵀ has rank 3, so the n×n systematic covariance is never formed.
+    # The kernel also returns the portfolio factor exposures wB[k] = w^T · b_k
+    # and the per-stock contributions used for the drill-down.
+    total_systematic, idio_var, wB, factor_contribs, idio_contribs = decompose_kernel(
+        w, B, F, d_vec, dtype=DECOMP_DTYPE
+    )
+    total_var = total_systematic + idio_var
 
     if total_var <= 0:
-        return _zero_result(tickers, weights)
+        return _zero_result(tickers, weights_out)
 
     # --- Decompose variance by factor ---
     # For each factor k, its marginal contribution: w^T · (b_k · var_k · b_k^T) · w
-    # where b_k is the column of B for factor k
+    # = (w^T · b_k)² · var_k, where b_k is the column of B for factor k
     factor_names = ["market", "smb", "hml"]
-    raw_contributions = {}
-
-    for k, name in enumerate(factor_names):
-        b_k = B[:, k]  # n-vector of factor-k loadings
-        # Pure factor-k variance contribution
-        var_k = F[k, k]
-        contrib = float((w * b_k) @ (w * b_k)) * var_k
-        raw_contributions[name] = max(contrib, 0.0)
+    raw_contributions = {
+        name: max(float(wB[k] * wB[k] * fac_vars[k]), 0.0)
+        for k, name in enumerate(factor_names)
+    }
 
-    # Cross-factor terms (total systematic - sum of pure factor terms)
-    total_systematic = float(w @ systematic_cov @ w)
+    # Cross-factor terms (total systematic - sum of pure factor terms);
+    # anything within working-precision noise is treated as exactly zero
     pure_factor_sum = sum(raw_contributions.values())
     cross_terms = total_systematic - pure_factor_sum
-
-    # Idiosyncratic contribution: w^T · D · w
-    idio_var = float(w @ D @ w)
+    if abs(cross_terms) <= CROSS_TERM_TOL * total_var:
+        cross_terms = 0.0
 
     # Apportion cross-factor terms proportionally to pure factor contributions
-    if pure_factor_sum > 0 and cross_terms != 0:
+    if pure_factor_sum > 0 and cross_terms != 0.0:
+        growth = 1.0 + cross_terms / pure_factor_sum
         for name in factor_names:
-            share = raw_contributions[name] / pure_factor_sum
-            raw_contributions[name] += cross_terms * share
+            raw_contributions[name] *= growth
 
     # Compute percentages
     market_pct = (raw_contributions["market"] / total_var) * 100
@@ -123,7 +185,7 @@ def decompose_portfolio_variance(
 
     # --- Per-stock contributions for flamegraph drill-down ---
     stock_contributions = _compute_stock_contributions(
-        tickers, w, B, F, D, total_var
+        tickers, weights_out, factor_contribs, idio_contribs, total_var
     )
 
     return {
@@ -141,38 +203,48 @@ def decompose_portfolio_variance(
 def _compute_stock_contributions(
     tickers: List[str],
     w: np.ndarray,
-    B: np.ndarray,
-    F: np.ndarray,
-    D: np.ndarray,
+    factor_contribs: np.ndarray,
+    idio_contribs: np.ndarray,
     total_var: float,
 ) -> Dict[str, Dict[str, float]]:
     """
-    Compute each stock's contribution to each factor bucket.
-    For factor k, stock i's contribution ≈ w_i * beta_ik * (sum_j w_j * beta_jk) * F[k,k].
-    For idiosyncratic, stock i's contribution = w_i² * D[i,i].
+    Convert each stock's raw contribution to each factor bucket into a
+    percentage of total variance.
+    For factor k, stock i's contribution ≈ w_i * beta_ik * (sum_j w_j * beta_jk) * F[k,k]
+    (factor_contribs, n×3). For idiosyncratic, stock i's contribution = w_i² * d_i
+    (idio_contribs).
     """
-    n = len(tickers)
-    contributions = {}
-
-    for i, ticker in enumerate(tickers):
-        # Market beta contribution
-        mkt_contrib = w[i] * B[i, 0] * float(w @ B[:, 0]) * F[0, 0]
-        smb_contrib = w[i] * B[i, 1] * float(w @ B[:, 1]) * F[1, 1]
-        hml_contrib = w[i] * B[i, 2] * float(w @ B[:, 2]) * F[2, 2]
-        idio_contrib = (w[i] ** 2) * D[i, i]
-
-        contributions[ticker] = {
-            "market_contribution": max(float(mkt_contrib / total_var * 100), 0) if total_var > 0 else 0,
-            "smb_contribution": max(float(smb_contrib / total_var * 100), 0) if total_var > 0 else 0,
-            "hml_contribution": max(float(hml_contrib / total_var * 100), 0) if total_var > 0 else 0,
-            "idio_contribution": max(float(idio_contrib / total_var * 100), 0) if total_var > 0 else 0,
-            "weight": float(w[i]),
+    if total_var <= 0:
+        return {
+            ticker: {
+                "market_contribution": 0, "smb_contribution": 0,
+                "hml_contribution": 0, "idio_contribution": 0,
+                "weight": float(w_i),
+            }
+            for ticker, w_i in zip(tickers, w)
+        }
+
+    scale = 100.0 / total_var
+    factor_pcts = np.maximum(factor_contribs * scale, 0.0).tolist()
+    idio_pcts = np.maximum(idio_contribs * scale, 0.0).tolist()
+
+    contributions = {
+        ticker: {
+            "market_contribution": mkt,
+            "smb_contribution": smb,
+            "hml_contribution": hml,
+            "idio_contribution": idio,
+            "weight": w_i,
         }
+        for ticker, (mkt, smb, hml), idio, w_i in zip(
+            tickers, factor_pcts, idio_pcts, w.tolist()
+        )
+    }
 
     return contributions
 
 
-def _zero_result(tickers, weights):
+def _zero_result(tickers, w):
     return {
         "market_pct": 25.0,
         "smb_pct": 25.0,
@@ -184,9 +256,9 @@ def _zero_result(tickers, weights):
             t: {
                 "market_contribution": 0, "smb_contribution": 0,
                 "hml_contribution": 0, "idio_contribution": 0,
-                "weight": weights.get(t, 0),
+                "weight": float(w_i),
             }
-            for t in tickers
+            for t, w_i in zip(tickers, w)
         },
     }
 
@@ -201,23 +273,26 @@ def build_flamegraph_json(
     sc = decomposition["stock_contributions"]
     vol = decomposition["total_annual_vol"]
 
+    # One frame of per-stock contributions, one set of meta dicts, shared by
+    # every factor's children
+    contribs_df = pd.DataFrame.from_dict(sc, orient="index")
+    meta_keys = ["beta_mkt", "beta_smb", "beta_hml", "r_squared"]
+    meta = {
+        ticker: {**{k: betas[ticker][k] for k in meta_keys}, "weight": weight}
+        for ticker, weight in zip(contribs_df.index, contribs_df.get("weight", []))
+    }
+
     def make_factor_children(factor_key: str):
-        children = []
-        for ticker, contrib in sc.items():
-            val = contrib[factor_key]
-            if val > 0.5:  # Only show stocks with meaningful contribution
-                children.append({
-                    "name": ticker,
-                    "value": round(val, 2),
-                    "meta": {
-                        "beta_mkt": betas[ticker]["beta_mkt"],
-                        "beta_smb": betas[ticker]["beta_smb"],
-                        "beta_hml": betas[ticker]["beta_hml"],
-                        "r_squared": betas[ticker]["r_squared"],
-                        "weight": contrib["weight"],
-                    },
-                })
-        return sorted(children, key=lambda x: x["value"], reverse=True)
+        if contribs_df.empty:
+            return []
+        col = contribs_df[factor_key]
+        # Only show stocks with meaningful contribution, largest first
+        # (ranked on the displayed 2dp value; ties keep portfolio order)
+        top = col[col > 0.5].round(2).sort_values(ascending=False, kind="stable")
+        return [
+            {"name": ticker, "value": val, "meta": dict(meta[ticker])}
+            for ticker, val in zip(top.index, top.tolist())
+        ]
 
     flamegraph = {
         "name": f"Your Portfolio — {vol:.1f}% Annual Vol",
@@ -3,17 +3,28 @@ Fama-French 3-factor pipeline: download factors, fetch prices, run regressions.
 """
 
 import io
+import os
+import re
+import tempfile
+import threading
 import time
 import zipfile
 import logging
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from datetime import date, datetime, timedelta
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import numpy as np
 import pandas as pd
 import requests
-import statsmodels.api as sm
+
+try:
+    import pyarrow  # noqa: F401 — parquet engine for the FF disk cache
+    _HAS_PARQUET = True
+except ImportError:
+    _HAS_PARQUET = False
 
 log = logging.getLogger(__name__)
 
@@ -21,21 +32,105 @@ DATA_DIR = Path(__file__).parent / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
 FF_CACHE_FILE = DATA_DIR / "ff_factors_daily.csv"
+FF_PARQUET_FILE = DATA_DIR / "ff_factors_daily.parquet"
 FF_URL = "https://mba.tuck.dartmouth.edu/pages/faculty/ken.french/ftp/F-F_Research_Data_Factors_daily_CSV.zip"
+FF_MAX_AGE_DAYS = 7
+FF_COLUMNS = ["Mkt-RF", "SMB", "HML", "RF"]
+
+# Start of the daily block (YYYYMMDD rows) and the first line after it
+_FF_DATA_START = re.compile(rb"^[ \t]*\d{8}[ \t]*,", re.MULTILINE)
+_FF_DATA_END = re.compile(rb"^(?![ \t]*\d)", re.MULTILINE)
+
+# Concurrent per-ticker price requests
+FETCH_WORKERS = 8
+
+# yf.download collects results in module-global state (shared._DFS), so
+# concurrent batch downloads from overlapping requests must not interleave
+_YF_DOWNLOAD_LOCK = threading.Lock()
+
+# Serializes FF cache misses so one process downloads and writes once
+_FF_LOAD_LOCK = threading.Lock()
+
+# How long a fetched CAD/USD series is reused within the process
+FX_CACHE_SECONDS = 3600
+
+# In-process memo of analyze_all results, keyed on the ticker set and day
+ANALYZE_CACHE_SECONDS = 3600
+ANALYZE_CACHE_SIZE = 256
+_ANALYZE_CACHE: Dict[Any, Any] = {}
+# analyze_all_cached is called from the request thread pool
+_ANALYZE_CACHE_LOCK = threading.Lock()
 
 
 def download_ff_factors() -> pd.DataFrame:
     """Download daily Fama-French 3-factor data from Ken French's library.
-    Caches to disk so subsequent runs skip the download."""
+    Caches to disk so subsequent runs skip the download, and keeps the parsed
+    frame in memory so repeated calls in the same process skip the CSV parse.
+    The returned DataFrame is shared between callers — treat it as read-only."""
+
+    cache_file = _ff_cache_file()
+    if cache_file.exists():
+        stat = cache_file.stat()
+        age = datetime.now() - datetime.fromtimestamp(stat.st_mtime)
+        key = (cache_file, stat.st_mtime_ns, age.days < FF_MAX_AGE_DAYS)
+    else:
+        key = (cache_file, None, False)
+    with _FF_LOAD_LOCK:
+        return _load_ff_cached(key)
+
+
+def _ff_cache_file() -> Path:
+    """The on-disk FF cache: Parquet when pyarrow is installed (loads the
+    parsed frame directly on restart), else CSV. An existing CSV cache is
+    still used until it goes stale."""
+    if _HAS_PARQUET and (FF_PARQUET_FILE.exists() or not FF_CACHE_FILE.exists()):
+        return FF_PARQUET_FILE
+    return FF_CACHE_FILE
+
+
+def _read_ff_cache(path: Path) -> pd.DataFrame:
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    df = pd.read_csv(path, index_col=0)
+    df.index = pd.to_datetime(df.index)
+    df.index.name = "Date"
+    return df
 
-    if FF_CACHE_FILE.exists():
-        age = datetime.now() - datetime.fromtimestamp(FF_CACHE_FILE.stat().st_mtime)
-        if age.days < 7:
+
+def _write_ff_cache(df: pd.DataFrame) -> Path:
+    """Write the parsed frame atomically, so concurrent workers and threads
+    never read a half-written cache file. Each writer gets its own temp file."""
+    path = FF_PARQUET_FILE if _HAS_PARQUET else FF_CACHE_FILE
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+    ) as fh:
+        tmp = Path(fh.name)
+    try:
+        if _HAS_PARQUET:
+            df.to_parquet(tmp)
+        else:
+            df.to_csv(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return path
+
+
+@lru_cache(maxsize=1)
+def _load_ff_cached(key) -> pd.DataFrame:
+    """Memoize the parsed FF frame. `key` changes whenever the cache file is
+    rewritten or goes stale, which evicts the single cached slot."""
+    return _download_ff_factors_uncached()
+
+
+def _download_ff_factors_uncached() -> pd.DataFrame:
+    cache_file = _ff_cache_file()
+    if cache_file.exists():
+        age = datetime.now() - datetime.fromtimestamp(cache_file.stat().st_mtime)
+        if age.days < FF_MAX_AGE_DAYS:
             log.info("Using cached FF data (%d days old)", age.days)
-            df = pd.read_csv(FF_CACHE_FILE, index_col=0)
-            df.index = pd.to_datetime(df.index)
-            df.index.name = "Date"
-            return df
+            return _read_ff_cache(cache_file)
 
     log.info("Downloading FF factor data from %s", FF_URL)
     resp = requests.get(FF_URL, timeout=30)
@@ -46,39 +141,37 @@ def download_ff_factors() -> pd.DataFrame:
         if not csv_name:
             raise ValueError("No CSV found in FF zip archive")
 
-        raw = zf.read(csv_name[0]).decode("utf-8", errors="replace")
+        raw = zf.read(csv_name[0])
 
-    lines = raw.splitlines()
-    start_idx = None
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        if stripped and stripped[0].isdigit() and len(stripped.split(",")) >= 4:
-            date_candidate = stripped.split(",")[0].strip()
-            if len(date_candidate) == 8 and date_candidate.isdigit():
-                start_idx = i
-                break
+    df = _parse_ff_csv(raw)
 
-    if start_idx is None:
-        raise ValueError("Could not find data start in Fama-French CSV")
+    cache_file = _write_ff_cache(df)
+    log.info("Cached %d days of FF data to %s", len(df), cache_file)
+    return df
 
-    data_lines = []
-    for line in lines[start_idx:]:
-        stripped = line.strip()
-        if not stripped or not stripped[0].isdigit():
-            break
-        data_lines.append(stripped)
 
-    csv_text = "Date,Mkt-RF,SMB,HML,RF\n" + "\n".join(data_lines)
-    df = pd.read_csv(io.StringIO(csv_text), parse_dates=False)
+def _parse_ff_csv(raw: bytes) -> pd.DataFrame:
+    """Parse the daily block of the Ken French CSV (YYYYMMDD rows, values in
+    percent) into a Date-indexed frame of decimal returns."""
+    start = _FF_DATA_START.search(raw)
+    if start is None:
+        raise ValueError("Could not find data start in Fama-French CSV")
 
-    df["Date"] = pd.to_datetime(df["Date"], format="%Y%m%d")
-    df = df.set_index("Date").sort_index()
+    end = _FF_DATA_END.search(raw, start.start() + 1)
+    block = raw[start.start():end.start() if end else len(raw)]
 
-    for col in ["Mkt-RF", "SMB", "HML", "RF"]:
-        df[col] = df[col].astype(float) / 100.0
+    df = pd.read_csv(
+        io.BytesIO(block),
+        header=None,
+        names=["Date"] + FF_COLUMNS,
+        dtype={"Date": str, **{col: np.float64 for col in FF_COLUMNS}},
+        skipinitialspace=True,
+        engine="c",
+    )
 
-    df.to_csv(FF_CACHE_FILE)
-    log.info("Cached %d days of FF data to %s", len(df), FF_CACHE_FILE)
+    df["Date"] = pd.to_datetime(df["Date"].str.strip(), format="%Y%m%d", cache=True)
+    df = df.set_index("Date").sort_index()
+    df[FF_COLUMNS] /= 100.0
     return df
 
 
@@ -114,52 +207,114 @@ def _fetch_via_yfinance(ticker: str) -> Optional[pd.Series]:
     return None
 
 
+def _fetch_via_yfinance_batch(tickers: List[str]) -> Dict[str, pd.Series]:
+    """Fetch all tickers from yfinance in one download call.
+    Returns {ticker: close_series} for the tickers that came back non-empty."""
+    try:
+        import yfinance as yf
+    except ImportError:
+        return {}
+
+    try:
+        with _YF_DOWNLOAD_LOCK:
+            df = yf.download(
+                tickers, period="18mo", group_by="ticker", threads=True,
+                progress=False, auto_adjust=True,
+            )
+    except Exception as e:
+        log.warning("yfinance batch download failed: %s", e)
+        return {}
+
+    if df is None or df.empty:
+        return {}
+
+    result = {}
+    for ticker in tickers:
+        try:
+            if isinstance(df.columns, pd.MultiIndex):
+                series = df[ticker]["Close"].dropna()
+            else:
+                series = df["Close"].dropna()
+        except KeyError:
+            continue
+        if series.empty:
+            continue
+        series = series.copy()
+        series.name = ticker
+        if series.index.tz is not None:
+            series.index = series.index.tz_localize(None)
+        series.index = series.index.normalize()
+        result[ticker] = series
+    return result
+
+
+def _fetch_via_stooq(ticker: str, start: datetime, end: datetime) -> Optional[pd.Series]:
+    """Fetch a single ticker from Stooq via pandas_datareader."""
+    try:
+        from pandas_datareader import data as pdr
+        df = pdr.DataReader(ticker, "stooq", start, end)
+
+        if df.empty or "Close" not in df.columns:
+            log.warning("Stooq: no data for %s either", ticker)
+            return None
+
+        series = df["Close"].sort_index()
+        series.name = ticker
+        return series
+
+    except Exception as e:
+        log.warning("Stooq also failed for %s: %s", ticker, e)
+    return None
+
+
 def fetch_prices(tickers: List[str], lookback_months: int = 18) -> pd.DataFrame:
     """Fetch close prices for a list of tickers.
     Uses yfinance as the primary source for all tickers.
-    Falls back to Stooq for non-TSX tickers if yfinance fails."""
+    Falls back to Stooq for non-TSX tickers if yfinance fails.
+    Tickers are fetched concurrently since the work is network-bound."""
 
     end = datetime.now()
     start = end - timedelta(days=lookback_months * 30)
     log.info("Fetching prices for %s from %s to %s", tickers, start.date(), end.date())
 
-    all_series = {}
     stooq_fallback = []
 
     # Try yfinance first for all tickers (avoids pandas_datareader
-    # parse_dates incompatibility with pandas 2.x)
-    for i, ticker in enumerate(tickers):
-        if i > 0:
-            time.sleep(1.0)
-        series = _fetch_via_yfinance(ticker)
-        if series is not None:
-            all_series[ticker] = series
-            log.info("✓ %s: %d days (yfinance)", ticker, len(series))
-        else:
-            if not _is_tsx_ticker(ticker):
-                stooq_fallback.append(ticker)
+    # parse_dates incompatibility with pandas 2.x): one batched download,
+    # then per-ticker retries for anything that came back empty
+    fetched = _fetch_via_yfinance_batch(tickers)
+    for ticker, series in fetched.items():
+        log.info("✓ %s: %d days (yfinance)", ticker, len(series))
+
+    missing = [t for t in dict.fromkeys(tickers) if t not in fetched]
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, max(len(missing), 1))) as ex:
+        futures = {ex.submit(_fetch_via_yfinance, t): t for t in missing}
+        for fut in as_completed(futures):
+            ticker = futures[fut]
+            series = fut.result()
+            if series is not None:
+                fetched[ticker] = series
+                log.info("✓ %s: %d days (yfinance)", ticker, len(series))
             else:
-                log.warning("No data for TSX ticker %s", ticker)
+                if not _is_tsx_ticker(ticker):
+                    stooq_fallback.append(ticker)
+                else:
+                    log.warning("No data for TSX ticker %s", ticker)
 
     # Fall back to Stooq for non-TSX tickers that yfinance missed
     if stooq_fallback:
         log.info("Falling back to Stooq for: %s", stooq_fallback)
-        for ticker in stooq_fallback:
-            try:
-                from pandas_datareader import data as pdr
-                df = pdr.DataReader(ticker, "stooq", start, end)
-
-                if df.empty or "Close" not in df.columns:
-                    log.warning("Stooq: no data for %s either", ticker)
-                    continue
-
-                series = df["Close"].sort_index()
-                series.name = ticker
-                all_series[ticker] = series
-                log.info("✓ %s: %d days (stooq)", ticker, len(series))
-
-            except Exception as e:
-                log.warning("Stooq also failed for %s: %s", ticker, e)
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(stooq_fallback))) as ex:
+            futures = {ex.submit(_fetch_via_stooq, t, start, end): t for t in stooq_fallback}
+            for fut in as_completed(futures):
+                ticker = futures[fut]
+                series = fut.result()
+                if series is not None:
+                    fetched[ticker] = series
+                    log.info("✓ %s: %d days (stooq)", ticker, len(series))
+
+    # Keep columns in request order regardless of completion order
+    all_series = {t: fetched[t] for t in tickers if t in fetched}
 
     if not all_series:
         raise ValueError(f"No price data returned for any ticker: {tickers}")
@@ -168,14 +323,39 @@ def fetch_prices(tickers: List[str], lookback_months: int = 18) -> pd.DataFrame:
     if failed:
         log.warning("No data for these tickers (excluded): %s", failed)
 
-    prices = pd.DataFrame(all_series)
+    # Align every series onto the sorted union of dates in one preallocated
+    # block, rather than letting the DataFrame constructor realign per column
+    idx = pd.DatetimeIndex(np.unique(np.concatenate(
+        [s.index.to_numpy() for s in all_series.values()]
+    )))
+    index_names = {s.index.name for s in all_series.values()}
+    idx.name = index_names.pop() if len(index_names) == 1 else None
+
+    arr = np.full((len(idx), len(all_series)), np.nan, dtype=np.float64)
+    for j, series in enumerate(all_series.values()):
+        arr[idx.get_indexer(series.index), j] = series.to_numpy(dtype=np.float64)
+
+    prices = pd.DataFrame(arr, index=idx, columns=list(all_series))
     prices = prices.dropna(how="all")
     return prices
 
 
 def _fetch_cad_usd_rate() -> Optional[pd.Series]:
     """Fetch CAD→USD daily exchange rate. FF factors are in USD,
-    so CAD-denominated returns must be converted."""
+    so CAD-denominated returns must be converted.
+    Cached in-process per clock hour; failed fetches are not cached."""
+    rate = _fetch_cad_usd_rate_cached(int(time.time() // FX_CACHE_SECONDS))
+    if rate is None:
+        _fetch_cad_usd_rate_cached.cache_clear()
+    return rate
+
+
+@lru_cache(maxsize=1)
+def _fetch_cad_usd_rate_cached(bucket: int) -> Optional[pd.Series]:
+    return _fetch_cad_usd_rate_uncached()
+
+
+def _fetch_cad_usd_rate_uncached() -> Optional[pd.Series]:
     try:
         import yfinance as yf
         fx = yf.Ticker("CADUSD=X")
@@ -219,41 +399,60 @@ def compute_excess_returns(
     prices: pd.DataFrame, ff_df: pd.DataFrame, tickers: Optional[List[str]] = None
 ) -> pd.DataFrame:
     """Compute daily excess returns (stock return minus risk-free rate).
-    Converts CAD returns to USD for TSX-listed stocks."""
-    returns = prices.pct_change().dropna()
+    Converts CAD returns to USD for TSX-listed stocks.
+    Only days with no return for any ticker are dropped; per-ticker gaps stay
+    NaN and are handled by the regressions."""
+    arr = prices.to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rets = arr[1:] / arr[:-1]
+    rets -= 1.0
+
+    keep = ~np.isnan(rets).all(axis=1)
+    returns = pd.DataFrame(rets[keep], index=prices.index[1:][keep], columns=prices.columns)
 
     if tickers:
         cad_tickers = [t for t in tickers if _is_tsx_ticker(t) and t in returns.columns]
         if cad_tickers:
             returns = _convert_cad_returns_to_usd(returns, cad_tickers)
 
-    common_dates = returns.index.intersection(ff_df.index)
-    returns = returns.loc[common_dates]
-    rf = ff_df.loc[common_dates, "RF"]
-    excess = returns.sub(rf, axis=0)
-    return excess
+    rows = ff_df.index.get_indexer(returns.index)
+    on_ff = rows >= 0
+    rf = ff_df["RF"].to_numpy(dtype=np.float64)[rows[on_ff]]
+    excess = returns.to_numpy(dtype=np.float64)[on_ff] - rf[:, None]
+    return pd.DataFrame(excess, index=returns.index[on_ff], columns=returns.columns)
+
+
+def _factor_matrix(ff_df: pd.DataFrame):
+    """Extract the factor columns once as a C-contiguous float64 array, so
+    regressions can slice rows by position instead of going through .loc."""
+    ff_arr = np.ascontiguousarray(
+        ff_df[["Mkt-RF", "SMB", "HML"]].to_numpy(dtype=np.float64)
+    )
+    return ff_arr, ff_df.index
 
 
 def run_factor_regression(
     ticker: str,
     excess_returns: pd.Series,
-    ff_df: pd.DataFrame,
+    ff_arr: np.ndarray,
+    ff_index: pd.Index,
     window: int = 252,
     min_obs: int = 60,
 ) -> Dict[str, Any]:
     """Run OLS regression of stock excess returns on MKT, SMB, HML factors.
-    Uses the most recent `window` trading days."""
-
-    common = excess_returns.dropna().index.intersection(ff_df.index)
-    if len(common) == 0:
+    Uses the most recent `window` trading days.
+    `ff_arr` is the float64 [Mkt-RF, SMB, HML] block of the FF frame and
+    `ff_index` its date index (see _factor_matrix)."""
+
+    y_all = excess_returns.dropna().sort_index()
+    rows = ff_index.get_indexer(y_all.index)
+    found = rows >= 0
+    if not found.any():
         return _empty_result(ticker)
 
-    common = common.sort_values()
-    if len(common) > window:
-        common = common[-window:]
-
-    y = excess_returns.loc[common].values
-    X = ff_df.loc[common, ["Mkt-RF", "SMB", "HML"]].values
+    rows = rows[found][-window:]
+    y = y_all.to_numpy(dtype=np.float64)[found][-window:]
+    X = ff_arr[rows]
     n_obs = len(y)
 
     if n_obs < min_obs:
@@ -269,26 +468,98 @@ def run_factor_regression(
             "sufficient_data": False,
         }
 
-    X_const = sm.add_constant(X)
+    X_const = np.column_stack([np.ones(n_obs), X])
 
     try:
-        model = sm.OLS(y, X_const).fit()
-    except Exception:
+        params, _, _, _ = np.linalg.lstsq(X_const, y, rcond=None)
+    except np.linalg.LinAlgError:
         return _empty_result(ticker)
 
+    resid = y - X_const @ params
+    ss_res = float(resid @ resid)
+    ss_tot = float(((y - y.mean()) ** 2).sum())
+
     return {
         "ticker": ticker,
-        "beta_mkt": float(model.params[1]),
-        "beta_smb": float(model.params[2]),
-        "beta_hml": float(model.params[3]),
-        "alpha": float(model.params[0]),
-        "r_squared": float(model.rsquared),
-        "residual_variance": float(np.var(model.resid, ddof=0)),
+        "beta_mkt": float(params[1]),
+        "beta_smb": float(params[2]),
+        "beta_hml": float(params[3]),
+        "alpha": float(params[0]),
+        "r_squared": 1.0 - ss_res / ss_tot if ss_tot > 0 else 0.0,
+        "residual_variance": ss_res / n_obs,
         "n_observations": n_obs,
         "sufficient_data": True,
     }
 
 
+def run_factor_regressions_batch(
+    tickers: List[str],
+    excess: pd.DataFrame,
+    ff_df: pd.DataFrame,
+    window: int = 252,
+    min_obs: int = 60,
+) -> Dict[str, Dict[str, Any]]:
+    """Run the factor regression for many tickers with a single lstsq solve.
+    Every ticker with a complete trailing `window` shares the same design
+    matrix, so they are solved together; tickers with gaps in that window
+    fall back to run_factor_regression."""
+
+    ff_arr, ff_index = _factor_matrix(ff_df)
+    cols = [t for t in dict.fromkeys(tickers) if t in excess.columns]
+    common = excess.index.intersection(ff_index).sort_values()[-window:]
+
+    batched = {}
+    if cols and len(common) >= min_obs:
+        Y_df = excess.loc[common, cols]
+        complete = [t for t, ok in zip(cols, Y_df.notna().all().to_numpy()) if ok]
+
+        if complete:
+            Y = Y_df[complete].to_numpy(dtype=np.float64)
+            X = ff_arr[ff_index.get_indexer(common)]
+            n_obs = len(common)
+            X_const = np.column_stack([np.ones(n_obs), X])
+
+            try:
+                params, _, _, _ = np.linalg.lstsq(X_const, Y, rcond=None)
+            except np.linalg.LinAlgError:
+                params = None
+
+            if params is not None:
+                resid = Y - X_const @ params
+                ss_res = (resid * resid).sum(axis=0)
+                ss_tot = ((Y - Y.mean(axis=0)) ** 2).sum(axis=0)
+                r_squared = np.where(
+                    ss_tot > 0, 1.0 - ss_res / np.where(ss_tot > 0, ss_tot, 1.0), 0.0
+                )
+                resid_var = ss_res / n_obs
+
+                for j, ticker in enumerate(complete):
+                    batched[ticker] = {
+                        "ticker": ticker,
+                        "beta_mkt": float(params[1, j]),
+                        "beta_smb": float(params[2, j]),
+                        "beta_hml": float(params[3, j]),
+                        "alpha": float(params[0, j]),
+                        "r_squared": float(r_squared[j]),
+                        "residual_variance": float(resid_var[j]),
+                        "n_observations": n_obs,
+                        "sufficient_data": True,
+                    }
+
+    results = {}
+    for ticker in tickers:
+        if ticker in batched:
+            results[ticker] = batched[ticker]
+        elif ticker in excess.columns:
+            results[ticker] = run_factor_regression(
+                ticker, excess[ticker], ff_arr, ff_index, window=window, min_obs=min_obs
+            )
+        else:
+            results[ticker] = _empty_result(ticker)
+
+    return results
+
+
 def _empty_result(ticker: str) -> Dict[str, Any]:
     return {
         "ticker": ticker,
@@ -311,12 +582,38 @@ def analyze_all(tickers: List[str]):
     prices = fetch_prices(tickers)
     excess = compute_excess_returns(prices, ff_df, tickers)
 
-    results = {}
-    for ticker in tickers:
-        if ticker in excess.columns:
-            result = run_factor_regression(ticker, excess[ticker], ff_df)
-        else:
-            result = _empty_result(ticker)
-        results[ticker] = result
+    results = run_factor_regressions_batch(tickers, excess, ff_df)
 
     return results, ff_df, prices
+
+
+def analyze_all_cached(tickers: List[str]):
+    """analyze_all memoized per ticker set for ANALYZE_CACHE_SECONDS.
+    The key includes today's date so cached betas never outlive the day.
+    Results are cached only when every ticker had sufficient data, so a
+    transient fetch failure for any of them is retried on the next call
+    (a ticker with genuinely too little history is refetched each time).
+    The returned frames are shared between callers — treat them as read-only."""
+    key = (tuple(sorted(set(tickers))), date.today())
+    now = time.monotonic()
+
+    with _ANALYZE_CACHE_LOCK:
+        entry = _ANALYZE_CACHE.get(key)
+        if entry is not None and entry[0] <= now:
+            _ANALYZE_CACHE.pop(key, None)
+            entry = None
+
+    if entry is not None:
+        results, ff_df, prices = entry[1]
+    else:
+        # The pipeline itself runs outside the lock; concurrent misses on the
+        # same key just both compute and the last write wins
+        results, ff_df, prices = analyze_all(tickers)
+        if all(r["sufficient_data"] for r in results.values()):
+            with _ANALYZE_CACHE_LOCK:
+                while len(_ANALYZE_CACHE) >= ANALYZE_CACHE_SIZE:
+                    _ANALYZE_CACHE.pop(next(iter(_ANALYZE_CACHE)), None)
+                _ANALYZE_CACHE[key] = (now + ANALYZE_CACHE_SECONDS, (results, ff_df, prices))
+
+    # Per-ticker dicts are handed to the response, so give each caller its own
+    return {t: dict(r) for t, r in results.items()}, ff_df, prices
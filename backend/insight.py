@@ -1,14 +1,13 @@
 """Generate plain-English insight sentences from variance decomposition output."""
 
-from typing import Dict, Any, List
+from typing import Dict, Any
 
 
-def generate_insight(
-    decomposition: Dict[str, Any],
-    positions: List[Dict[str, Any]],
-) -> str:
+def generate_insight(decomposition: Dict[str, Any]) -> str:
     """
     Generate one plain-English insight sentence from the variance decomposition.
+    Everything it needs (including per-stock contributions) is in the
+    decomposition, so no separate position list is taken.
 
     Priority order:
     1. If market_pct > 65% → warn about market concentration
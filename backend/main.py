@@ -1,19 +1,52 @@
 """FastAPI application entry point."""
 
+import logging
+import logging.handlers
 import os
+import queue
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from routers.analyze import router as analyze_router
-from routers.questrade import router as questrade_router
+from routers.questrade import router as questrade_router, close_transport
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Request handlers only enqueue log records; a background thread does the
+    # formatting-to-stderr I/O, so error bursts don't serialize requests
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    listener.start()
+    try:
+        yield
+    finally:
+        # Release the shared Questrade keep-alive connections
+        await close_transport()
+        listener.stop()
+        root.removeHandler(queue_handler)
+
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Portfolio Risk Flamegraph",
     description="Fama-French 3-factor variance decomposition API",
     version="1.0.0",
+    # orjson's C encoder is much faster than stdlib json on the nested flamegraph payload
+    default_response_class=ORJSONResponse,
 )
 
 # CORS — allow frontend to call backend
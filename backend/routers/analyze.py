@@ -1,23 +1,32 @@
 """Portfolio analysis endpoints: /api/analyze and /api/upload-csv."""
 
+import asyncio
 import io
-import csv
-import traceback
-from typing import List, Optional
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
+import pandas as pd
 from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
-from factor_pipeline import analyze_all, download_ff_factors
+from factor_pipeline import analyze_all_cached
 from decomposition import (
     compute_factor_covariance,
-    decompose_portfolio_variance,
+    decompose_portfolio_variance_arrays,
     build_flamegraph_json,
 )
 from insight import generate_insight
 
+log = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api", tags=["analysis"])
 
+# Currency/thousands characters stripped from CSV number cells
+_MV_CLEAN = re.compile(r"[$,]")
+
 
 
 
@@ -39,7 +48,52 @@ class AnalyzeResponse(BaseModel):
 
 
 
-@router.post("/analyze", response_model=AnalyzeResponse)
+def _crunch(
+    tickers: List[str],
+    w: np.ndarray,
+    betas: Dict[str, Dict[str, Any]],
+    factor_cov: np.ndarray,
+    price_matrix: np.ndarray,
+    col_weights: np.ndarray,
+):
+    """
+    CPU-bound half of the analysis: decomposition, flamegraph, insight and
+    realized vol. Pure function of its inputs so it can run off the event loop.
+    Returns (decomposition, flamegraph, insight, realized_vol).
+    """
+    # 3. Factor loadings (n × 3) and residual variances, aligned with w
+    rows = [betas[t] for t in tickers]
+    B = np.array(
+        [(r["beta_mkt"], r["beta_smb"], r["beta_hml"]) for r in rows], dtype=np.float64
+    ).reshape(len(rows), 3)
+    d_vec = np.fromiter(
+        (r["residual_variance"] for r in rows), dtype=np.float64, count=len(rows)
+    )
+
+    # 4. Decompose portfolio variance
+    decomposition = decompose_portfolio_variance_arrays(tickers, w, B, factor_cov, d_vec)
+
+    # 5. Build flamegraph JSON
+    flamegraph = build_flamegraph_json(decomposition, betas)
+
+    # 6. Generate insight
+    insight = generate_insight(decomposition)
+
+    # 7. Compute historical realized vol for sanity check
+    realized_vol = None
+    try:
+        # Simple daily returns on the raw price matrix (rows with any gap dropped)
+        R = price_matrix[1:] / price_matrix[:-1] - 1.0
+        R = R[np.isfinite(R).all(axis=1)]
+        port_returns = R @ col_weights
+        realized_vol = round(float(port_returns.std(ddof=1) * np.sqrt(252) * 100), 2)
+    except Exception:
+        pass
+
+    return decomposition, flamegraph, insight, realized_vol
+
+
+@router.post("/analyze", response_model=AnalyzeResponse, response_class=ORJSONResponse)
 async def analyze_portfolio(request: AnalyzeRequest):
     """
     Main analysis endpoint. Takes positions (symbol + market_value),
@@ -48,53 +102,53 @@ async def analyze_portfolio(request: AnalyzeRequest):
     if not request.positions:
         raise HTTPException(status_code=400, detail="No positions provided")
 
+    # Merge duplicate symbols (e.g. the same stock held in two accounts)
+    # so each ticker is analyzed once with its combined market value
+    merged: Dict[str, float] = {}
+    for p in request.positions:
+        t = p.symbol.upper()
+        merged[t] = merged.get(t, 0.0) + p.market_value
+
     # Compute portfolio weights
-    total_value = sum(p.market_value for p in request.positions)
+    tickers = list(merged)
+    mv = np.fromiter(merged.values(), dtype=np.float64, count=len(merged))
+    total_value = mv.sum()
     if total_value <= 0:
         raise HTTPException(status_code=400, detail="Total portfolio value must be positive")
 
-    tickers = [p.symbol.upper() for p in request.positions]
-    weights = {
-        p.symbol.upper(): p.market_value / total_value
-        for p in request.positions
-    }
+    w = mv / total_value
 
     try:
-        # 1. Run factor regressions
-        betas, ff_df, prices = analyze_all(tickers)
+        loop = asyncio.get_running_loop()
 
-        # 2. Compute factor covariance matrix
-        factor_cov = compute_factor_covariance(ff_df)
+        # 1. Run factor regressions — network-bound (prices/FF download),
+        #    so it runs on the default thread pool
+        betas, ff_df, prices = await loop.run_in_executor(None, analyze_all_cached, tickers)
 
-        # 3. Extract residual variances
-        residual_vars = {t: betas[t]["residual_variance"] for t in tickers}
+        # 2. Compute factor covariance matrix (memoized per FF frame, so it
+        #    stays in this process)
+        factor_cov = compute_factor_covariance(ff_df)
 
-        # 4. Decompose portfolio variance
-        decomposition = decompose_portfolio_variance(
-            weights, betas, factor_cov, residual_vars
+        # Price block for the realized-vol check, aligned with its weights
+        present = pd.Index(tickers).isin(prices.columns)
+        cols = [t for t, ok in zip(tickers, present) if ok]
+        col_weights = w[present]
+        price_matrix = prices[cols].to_numpy(dtype=np.float64)
+
+        # 3-7. CPU-bound math also runs on the thread pool. A process pool
+        #      costs more in pickling/IPC (and worker spawn on Windows) than
+        #      the few milliseconds of NumPy work it would offload.
+        decomposition, flamegraph, insight, realized_vol = await loop.run_in_executor(
+            None, _crunch,
+            tickers, w, betas, factor_cov, price_matrix, col_weights,
         )
 
-        # 5. Build flamegraph JSON
-        flamegraph = build_flamegraph_json(decomposition, betas)
-
-        # 6. Generate insight
-        positions_list = [{"symbol": t, "weight": weights[t]} for t in tickers]
-        insight = generate_insight(decomposition, positions_list)
-
-        # 7. Compute historical realized vol for sanity check
-        realized_vol = None
-        try:
-            port_returns = sum(
-                prices[t].pct_change().dropna() * weights[t]
-                for t in tickers if t in prices.columns
-            )
-            realized_vol = round(float(port_returns.std() * (252 ** 0.5) * 100), 2)
-        except Exception:
-            pass
-
-        return AnalyzeResponse(
-            flamegraph=flamegraph,
-            decomposition={
+        # Returned as ORJSONResponse directly: the payload is already plain
+        # Python floats/dicts, so the response_model validation and
+        # jsonable_encoder walk over the nested flamegraph are skipped
+        return ORJSONResponse({
+            "flamegraph": flamegraph,
+            "decomposition": {
                 "market_pct": decomposition["market_pct"],
                 "smb_pct": decomposition["smb_pct"],
                 "hml_pct": decomposition["hml_pct"],
@@ -103,18 +157,52 @@ async def analyze_portfolio(request: AnalyzeRequest):
                 "total_annual_vol": decomposition["total_annual_vol"],
                 "realized_vol": realized_vol,
             },
-            insight=insight,
-            stock_details=betas,
-        )
+            "insight": insight,
+            "stock_details": betas,
+        })
 
     except Exception as e:
-        traceback.print_exc()
+        log.exception("Analysis failed for %s", tickers)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
 
 
-@router.post("/upload-csv")
+def _read_csv_cells(content: bytes) -> Tuple[pd.DataFrame, int]:
+    """
+    Read an uploaded CSV as raw string cells, header row included (so
+    duplicate names stay as-is instead of being mangled to "value.1").
+    "NA" is a ticker, not a missing value; utf-8-sig handles the BOM.
+
+    Rows longer than the header are trimmed when the extra fields are blank
+    (exports with a trailing comma on every row) and dropped when they hold
+    data (e.g. an unquoted "$1,000"), rather than misparsed.
+    Returns (cells, number of dropped rows).
+    """
+    options = dict(header=None, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    try:
+        # Fast path: well-formed files go through the C parser
+        return pd.read_csv(io.BytesIO(content), engine="c", **options), 0
+    except pd.errors.ParserError:
+        pass
+
+    width = pd.read_csv(io.BytesIO(content), engine="python", nrows=1, **options).shape[1]
+    dropped = 0
+
+    def fit_to_header(fields: List[str]) -> Optional[List[str]]:
+        nonlocal dropped
+        if all(not f.strip() for f in fields[width:]):
+            return fields[:width]
+        dropped += 1
+        return None
+
+    df = pd.read_csv(
+        io.BytesIO(content), engine="python", on_bad_lines=fit_to_header, **options
+    )
+    return df, dropped
+
+
+@router.post("/upload-csv", response_class=ORJSONResponse)
 async def upload_csv(file: UploadFile = File(...)):
     """
     Parse a Wealthsimple CSV export and return normalized positions.
@@ -125,68 +213,77 @@ async def upload_csv(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="File must be a CSV")
 
     content = await file.read()
-    text = content.decode("utf-8-sig")  # Handle BOM
 
     try:
-        reader = csv.DictReader(io.StringIO(text))
-        rows = list(reader)
+        df, dropped = _read_csv_cells(content)
+    except pd.errors.EmptyDataError:
+        raise HTTPException(status_code=400, detail="CSV is empty")
     except Exception as e:
+        log.warning("Could not parse uploaded CSV %s: %s", file.filename, e)
         raise HTTPException(status_code=400, detail=f"Could not parse CSV: {str(e)}")
 
-    if not rows:
+    if len(df) < 2:
+        if dropped:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Could not parse CSV: all {dropped} data rows have more "
+                       "fields than the header (unquoted commas in a value?)",
+            )
         raise HTTPException(status_code=400, detail="CSV is empty")
 
-    # Normalize column names (case-insensitive, strip whitespace)
-    fieldnames = {k.strip().lower(): k for k in rows[0].keys()}
-
-    positions = []
-    for row in rows:
-        # Try to find symbol column
-        symbol = None
-        for key_candidate in ["symbol", "ticker", "stock", "security"]:
-            if key_candidate in fieldnames:
-                symbol = row[fieldnames[key_candidate]].strip()
-                break
-
-        if not symbol:
-            continue
-
-        # Try to find market value column
-        market_value = None
-        for key_candidate in ["market value", "marketvalue", "market_value", "value", "total"]:
-            if key_candidate in fieldnames:
-                raw = row[fieldnames[key_candidate]].strip().replace("$", "").replace(",", "")
-                try:
-                    market_value = float(raw)
-                except ValueError:
-                    continue
-                break
-
-        # Fallback: compute from quantity × price
-        if market_value is None:
-            qty_col = None
-            price_col = None
-            for key_candidate in ["quantity", "qty", "shares", "openquantity"]:
-                if key_candidate in fieldnames:
-                    qty_col = fieldnames[key_candidate]
-                    break
-            for key_candidate in ["current price", "price", "currentprice", "last price"]:
-                if key_candidate in fieldnames:
-                    price_col = fieldnames[key_candidate]
-                    break
-
-            if qty_col and price_col:
-                try:
-                    qty = float(row[qty_col].strip().replace(",", ""))
-                    price = float(row[price_col].strip().replace("$", "").replace(",", ""))
-                    market_value = qty * price
-                except (ValueError, KeyError):
-                    continue
-
-        if market_value and market_value > 0:
-            # Clean up symbol — remove exchange suffixes if needed
-            symbol = symbol.replace(" ", "").upper()
-            positions.append({"symbol": symbol, "market_value": round(market_value, 2)})
+    # Normalize column names (case-insensitive, strip whitespace); a repeated
+    # column name resolves to its last occurrence, as with csv.DictReader
+    df.columns = pd.Index(df.iloc[0].fillna("")).str.strip().str.lower()
+    df = df.iloc[1:].reset_index(drop=True)
+    df = df.loc[:, ~df.columns.duplicated(keep="last")].fillna("")
+
+    def resolve(candidates):
+        return [k for k in candidates if k in df.columns]
+
+    def to_number(col: pd.Series, strip: re.Pattern = _MV_CLEAN) -> pd.Series:
+        col = col.str.strip()
+        values = pd.to_numeric(col, errors="coerce")
+        # Only cells that didn't parse as-is (e.g. "$1,234.50") go through the regex
+        dirty = values.isna() & (col != "")
+        if dirty.any():
+            values[dirty] = pd.to_numeric(
+                col[dirty].str.replace(strip, "", regex=True), errors="coerce"
+            )
+        return values
+
+    symbol_cols = resolve(["symbol", "ticker", "stock", "security"])
+    mv_cols = resolve(["market value", "marketvalue", "market_value", "value", "total"])
+    qty_cols = resolve(["quantity", "qty", "shares", "openquantity"])
+    price_cols = resolve(["current price", "price", "currentprice", "last price"])
+
+    if symbol_cols:
+        symbols = df[symbol_cols[0]].str.strip()
+    else:
+        symbols = pd.Series("", index=df.index)
+
+    # First market value column that parses as a number
+    market_value = pd.Series(np.nan, index=df.index)
+    for mv_col in mv_cols:
+        market_value = market_value.fillna(to_number(df[mv_col]))
+
+    # Fallback: compute from quantity × price
+    if qty_cols and price_cols:
+        qty = pd.to_numeric(
+            df[qty_cols[0]].str.strip().str.replace(",", "", regex=False), errors="coerce"
+        )
+        price = to_number(df[price_cols[0]])
+        market_value = market_value.fillna(qty * price)
+
+    keep = (symbols != "") & (market_value > 0) & np.isfinite(market_value)
+
+    # Clean up symbol — remove exchange suffixes if needed. Repeated holdings
+    # (e.g. the same stock across accounts) are normalized once per distinct symbol.
+    codes, uniques = pd.factorize(symbols[keep])
+    clean_symbols = pd.Index(uniques).str.replace(" ", "", regex=False).str.upper()[codes]
+    positions = [
+        {"symbol": symbol, "market_value": round(value, 2)}
+        for symbol, value in zip(clean_symbols.tolist(), market_value[keep].tolist())
+    ]
 
     if not positions:
         raise HTTPException(
@@ -195,4 +292,4 @@ async def upload_csv(file: UploadFile = File(...)):
                    "Expected columns: Symbol and Market Value (or Quantity + Price)."
         )
 
-    return {"positions": positions}
+    return ORJSONResponse({"positions": positions})
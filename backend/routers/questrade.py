@@ -1,9 +1,11 @@
 """Questrade OAuth integration: one-time portfolio fetch, token discarded."""
 
+import asyncio
 import os
-from typing import Optional
+from typing import Any, Dict, List
+from urllib.parse import urlencode
 
-import requests
+import httpx
 from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import RedirectResponse
 
@@ -17,6 +19,50 @@ QUESTRADE_REDIRECT_URI = os.getenv("QUESTRADE_REDIRECT_URI", "http://localhost:8
 QUESTRADE_AUTH_URL = "https://login.questrade.com/oauth2/authorize"
 QUESTRADE_TOKEN_URL = "https://login.questrade.com/oauth2/token"
 
+# One keep-alive connection pool for every Questrade call, so the token,
+# accounts and positions requests (and later callbacks) skip repeat TLS
+# handshakes. Retries apply to failed connection attempts only.
+_transport = httpx.AsyncHTTPTransport(
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+    retries=2,
+)
+
+
+def _client() -> httpx.AsyncClient:
+    """A per-request client (own cookie jar) on the shared pool. Don't use it
+    as a context manager — closing the client would close the pool."""
+    return httpx.AsyncClient(transport=_transport, timeout=15)
+
+
+async def close_transport():
+    """Close the shared connection pool on app shutdown."""
+    await _transport.aclose()
+
+
+async def _fetch_positions(
+    client: httpx.AsyncClient,
+    api_server: str,
+    headers: Dict[str, str],
+    accounts: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Fetch the positions payloads for all accounts.
+    Questrade only serves positions per account, so the requests are issued
+    concurrently rather than one after another.
+    """
+    pos_resps = await asyncio.gather(*[
+        client.get(
+            f"{api_server}v1/accounts/{account['number']}/positions",
+            headers=headers,
+        )
+        for account in accounts
+    ])
+    payloads = []
+    for pos_resp in pos_resps:
+        pos_resp.raise_for_status()
+        payloads.append(pos_resp.json())
+    return payloads
+
 
 @router.get("/questrade")
 async def questrade_auth():
@@ -34,7 +80,7 @@ async def questrade_auth():
         "response_type": "code",
         "redirect_uri": QUESTRADE_REDIRECT_URI,
     }
-    auth_url = f"{QUESTRADE_AUTH_URL}?{'&'.join(f'{k}={v}' for k, v in params.items())}"
+    auth_url = f"{QUESTRADE_AUTH_URL}?{urlencode(params)}"
     return RedirectResponse(url=auth_url)
 
 
@@ -51,8 +97,9 @@ async def questrade_callback(code: str = Query(...)):
     api_server = None
 
     try:
+        client = _client()
         # 1. Exchange code for access token
-        token_resp = requests.post(
+        token_resp = await client.post(
             QUESTRADE_TOKEN_URL,
             data={
                 "client_id": QUESTRADE_CLIENT_ID,
@@ -60,7 +107,6 @@ async def questrade_callback(code: str = Query(...)):
                 "grant_type": "authorization_code",
                 "redirect_uri": QUESTRADE_REDIRECT_URI,
             },
-            timeout=15,
         )
         token_resp.raise_for_status()
         token_data = token_resp.json()
@@ -71,28 +117,20 @@ async def questrade_callback(code: str = Query(...)):
         headers = {"Authorization": f"Bearer {access_token}"}
 
         # 2. Fetch accounts
-        accounts_resp = requests.get(
-            f"{api_server}v1/accounts",
-            headers=headers,
-            timeout=15,
-        )
+        accounts_resp = await client.get(f"{api_server}v1/accounts", headers=headers)
         accounts_resp.raise_for_status()
         accounts = accounts_resp.json().get("accounts", [])
 
         if not accounts:
             raise HTTPException(status_code=404, detail="No accounts found")
 
-        # 3. Fetch positions from each account
-        all_positions = []
-        for account in accounts:
-            account_id = account["number"]
-            pos_resp = requests.get(
-                f"{api_server}v1/accounts/{account_id}/positions",
-                headers=headers,
-                timeout=15,
-            )
-            pos_resp.raise_for_status()
-            positions = pos_resp.json().get("positions", [])
+        # 3. Fetch positions from every account
+        payloads = await _fetch_positions(client, api_server, headers, accounts)
+
+        # Roll up the same symbol held across several accounts
+        totals: Dict[str, float] = {}
+        for payload in payloads:
+            positions = payload.get("positions", [])
 
             for pos in positions:
                 symbol = pos.get("symbol", "")
@@ -100,10 +138,12 @@ async def questrade_callback(code: str = Query(...)):
 
                 if symbol and market_value and market_value > 0:
                     # Questrade uses .TO suffix for TSX stocks — keep as-is for yfinance
-                    all_positions.append({
-                        "symbol": symbol,
-                        "market_value": round(float(market_value), 2),
-                    })
+                    totals[symbol] = totals.get(symbol, 0.0) + float(market_value)
+
+        all_positions = [
+            {"symbol": symbol, "market_value": round(market_value, 2)}
+            for symbol, market_value in totals.items()
+        ]
 
         if not all_positions:
             raise HTTPException(status_code=404, detail="No positions with market value found")
@@ -114,7 +154,7 @@ async def questrade_callback(code: str = Query(...)):
             "message": "Positions fetched successfully. Access token has been discarded.",
         }
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Questrade API error: {str(e)}")
 
     finally:
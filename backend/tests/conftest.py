@@ -0,0 +1,33 @@
+"""
+tests/conftest.py — Shared network-backed fixtures
+
+Downloads are done once per test session (once per worker under
+`pytest -n auto`) instead of once per test.
+"""
+
+import sys
+import os
+import pytest
+
+# Add parent dir to path so we can import backend modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture(scope="session")
+def ff_df():
+    from factor_pipeline import download_ff_factors
+    return download_ff_factors()
+
+
+@pytest.fixture(scope="session")
+def aapl_analysis():
+    """(results, ff_df, prices) for ["AAPL"]."""
+    from factor_pipeline import analyze_all
+    return analyze_all(["AAPL"])
+
+
+@pytest.fixture(scope="session")
+def aapl_msft_analysis():
+    """(results, ff_df, prices) for ["AAPL", "MSFT"]."""
+    from factor_pipeline import analyze_all
+    return analyze_all(["AAPL", "MSFT"])
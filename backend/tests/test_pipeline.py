@@ -2,6 +2,8 @@
 tests/test_pipeline.py — Automated Tests for Factor Pipeline & Decomposition
 
 Run with: py -m pytest tests/test_pipeline.py -v
+(network-backed data comes from the session fixtures in conftest.py;
+add `-n auto` with pytest-xdist to overlap the remaining waits)
 """
 
 import sys
@@ -15,9 +17,8 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 class TestFamaFrenchDownload:
     """Test that we can download and parse Fama-French factor data."""
 
-    def test_download_ff_factors(self):
-        from factor_pipeline import download_ff_factors
-        df = download_ff_factors()
+    def test_download_ff_factors(self, ff_df):
+        df = ff_df
 
         assert not df.empty, "FF factor DataFrame should not be empty"
         assert "Mkt-RF" in df.columns
@@ -26,20 +27,48 @@ class TestFamaFrenchDownload:
         assert "RF" in df.columns
         assert len(df) > 100, "Should have at least 100 days of factor data"
 
-    def test_ff_data_is_decimal(self):
-        from factor_pipeline import download_ff_factors
-        df = download_ff_factors()
+    def test_ff_data_is_decimal(self, ff_df):
+        df = ff_df
 
         # Should be in decimal form (e.g. 0.01), not percent (e.g. 1.0)
         assert abs(df["Mkt-RF"].mean()) < 0.05, "Mkt-RF mean should be near 0 in decimal form"
 
+    def test_parse_ff_csv_daily_block(self):
+        """Offline: only the daily block is parsed, dated, and scaled to decimals."""
+        import pandas as pd
+        from factor_pipeline import _parse_ff_csv
+
+        raw = (
+            "This file was created by CMPT_ME_BEME_RETS_DAILY using the 202401 CRSP database.\r\n"
+            "The 1-month TBill return is from Ibbotson and Associates Inc.\r\n"
+            "\r\n"
+            ",Mkt-RF,SMB,HML,RF\r\n"
+            "19260701,    0.10,   -0.25,   -0.27,    0.01\r\n"
+            "19260702,    0.45,   -0.33,   -0.06,    0.01\r\n"
+            "20240131,   -1.50,    0.20,    1.00,    0.02\r\n"
+            "\r\n"
+            " Annual Factors: January-December \r\n"
+            ",Mkt-RF,SMB,HML,RF\r\n"
+            "  1927,   29.47,   -2.46,   -3.75,    3.12\r\n"
+            "\r\n"
+            "Copyright 2024 Kenneth R. French\r\n"
+        ).encode()
+
+        df = _parse_ff_csv(raw)
+
+        assert len(df) == 3, "Annual block and copyright must not be parsed"
+        assert list(df.columns) == ["Mkt-RF", "SMB", "HML", "RF"]
+        assert list(df.index) == list(pd.to_datetime(["1926-07-01", "1926-07-02", "2024-01-31"]))
+        assert df.index.name == "Date"
+        assert abs(df.loc["2024-01-31", "Mkt-RF"] - (-0.015)) < 1e-12
+        assert abs(df.loc["1926-07-01", "RF"] - 0.0001) < 1e-12
+
 
 class TestPriceFetching:
     """Test stock price fetching."""
 
-    def test_fetch_single_us_stock(self):
-        from factor_pipeline import fetch_prices
-        prices = fetch_prices(["AAPL"])
+    def test_fetch_single_us_stock(self, aapl_analysis):
+        _, _, prices = aapl_analysis
 
         assert not prices.empty, "Should get price data for AAPL"
         assert "AAPL" in prices.columns
@@ -54,13 +83,45 @@ class TestPriceFetching:
         assert _is_tsx_ticker("MSFT") is False
 
 
+    def test_excess_returns_gaps_and_calendar(self):
+        """Offline: short-history and gapped tickers keep per-ticker NaNs, and
+        only dates present in the factor index survive."""
+        import numpy as np
+        import pandas as pd
+        from factor_pipeline import compute_excess_returns
+
+        dates = pd.bdate_range("2024-01-01", periods=8)
+        nan = np.nan
+        prices = pd.DataFrame({
+            "AAA": [100, 101, 102, nan, 104, 105, 106, 107],   # day 3 has no prices at all
+            "GAP": [50, 51, 52, nan, 54, nan, 56, 57],         # interior gaps
+            "NEW": [nan, nan, nan, nan, nan, 10, 11, 12],      # short history
+        }, index=dates, dtype=float)
+
+        ff_dates = dates.drop(dates[6]).append(pd.DatetimeIndex(["2024-02-01"]))
+        ff_df = pd.DataFrame({"RF": np.arange(len(ff_dates)) * 1e-4}, index=ff_dates)
+
+        got = compute_excess_returns(prices, ff_df, list(prices.columns))
+
+        # Reference: pandas returns, drop days with no return at all, inner join on FF dates
+        rets = prices.pct_change(fill_method=None).iloc[1:].dropna(how="all")
+        rets = rets.loc[rets.index.isin(ff_df.index)]
+        expected = rets.sub(ff_df["RF"].reindex(rets.index), axis=0)
+        pd.testing.assert_frame_equal(got, expected, check_freq=False)
+
+        # Day 3 has no prices and day 4 has no prior price: no return at all.
+        # Day 6 is missing from the FF index.
+        assert list(got.index) == [dates[1], dates[2], dates[5], dates[7]]
+        assert got["GAP"].isna().tolist() == [False, False, True, False]
+        assert got["NEW"].notna().tolist() == [False, False, False, True]
+
+
 class TestFactorRegression:
     """Test OLS regression outputs are sensible."""
 
-    def test_aapl_beta_range(self):
+    def test_aapl_beta_range(self, aapl_analysis):
         """AAPL market beta should be roughly 1.0-1.6 (known ballpark)."""
-        from factor_pipeline import analyze_all
-        results, ff_df, prices = analyze_all(["AAPL"])
+        results, ff_df, prices = aapl_analysis
 
         aapl = results["AAPL"]
         assert aapl["sufficient_data"] is True, "AAPL should have sufficient data"
@@ -68,6 +129,57 @@ class TestFactorRegression:
         assert aapl["r_squared"] > 0.2, f"AAPL R²={aapl['r_squared']:.3f} too low"
         assert aapl["n_observations"] >= 60, "Should have at least 60 observations"
 
+    def test_batch_matches_per_ticker_regression(self):
+        """Offline: the shared-design batch solve agrees with the per-ticker path,
+        including gap, short-history and missing tickers."""
+        import numpy as np
+        import pandas as pd
+        from factor_pipeline import (
+            _empty_result, _factor_matrix, run_factor_regression, run_factor_regressions_batch,
+        )
+
+        rng = np.random.default_rng(7)
+        dates = pd.bdate_range("2023-01-02", periods=400)
+        ff_df = pd.DataFrame(
+            rng.normal(0, 0.01, (400, 4)), index=dates, columns=["Mkt-RF", "SMB", "HML", "RF"]
+        )
+        F = ff_df[["Mkt-RF", "SMB", "HML"]].to_numpy()
+
+        true_betas = {"AAA": [1.2, 0.4, -0.3], "BBB": [0.8, -0.2, 0.5], "EXACT": [1.0, 0.5, 0.25]}
+        excess = pd.DataFrame(index=dates)
+        for t, b in true_betas.items():
+            noise = 0.0 if t == "EXACT" else rng.normal(0, 0.005, 400)
+            excess[t] = 0.0002 + F @ np.array(b) + noise
+        excess["GAP"] = F @ np.array([0.9, 0.1, 0.1]) + rng.normal(0, 0.005, 400)
+        excess.iloc[-10:-5, excess.columns.get_loc("GAP")] = np.nan    # gap inside the window
+        excess["NEW"] = np.nan
+        excess.iloc[-30:, excess.columns.get_loc("NEW")] = rng.normal(0, 0.01, 30)
+
+        tickers = ["AAA", "BBB", "EXACT", "GAP", "NEW", "MISSING"]
+        batch = run_factor_regressions_batch(tickers, excess, ff_df)
+
+        ff_arr, ff_index = _factor_matrix(ff_df)
+        for t in ["AAA", "BBB", "EXACT", "GAP", "NEW"]:
+            single = run_factor_regression(t, excess[t], ff_arr, ff_index)
+            assert batch[t].keys() == single.keys()
+            for key, val in single.items():
+                if isinstance(val, float):
+                    assert abs(batch[t][key] - val) < 1e-10, f"{t}.{key}: {batch[t][key]} vs {val}"
+                else:
+                    assert batch[t][key] == val, f"{t}.{key}"
+
+        assert batch["GAP"]["sufficient_data"] is True
+        # Fallback path: the 5 missing days are skipped, the window reaches further back
+        assert batch["GAP"]["n_observations"] == 252
+        assert batch["NEW"]["sufficient_data"] is False
+        assert batch["MISSING"] == _empty_result("MISSING")
+        assert batch["AAA"]["n_observations"] == 252
+        # Noise-free ticker recovers its loadings and intercept exactly
+        got = [batch["EXACT"][k] for k in ("beta_mkt", "beta_smb", "beta_hml")]
+        assert np.allclose(got, true_betas["EXACT"], atol=1e-10)
+        assert abs(batch["EXACT"]["alpha"] - 0.0002) < 1e-10
+        assert abs(batch["EXACT"]["r_squared"] - 1.0) < 1e-10
+
     def test_insufficient_data_handling(self):
         """A very new or invalid ticker should return sufficient_data=False."""
         from factor_pipeline import _empty_result
@@ -75,16 +187,67 @@ class TestFactorRegression:
         assert result["sufficient_data"] is False
 
 
+class TestAnalyzeCache:
+    """Test analyze_all_cached with a stubbed pipeline (offline)."""
+
+    @pytest.fixture
+    def calls(self, monkeypatch):
+        import factor_pipeline
+
+        calls = []
+
+        def fake_analyze_all(tickers):
+            calls.append(list(tickers))
+            results = {t: {"ticker": t, "sufficient_data": not t.startswith("BAD")} for t in tickers}
+            return results, None, None
+
+        monkeypatch.setattr(factor_pipeline, "analyze_all", fake_analyze_all)
+        monkeypatch.setattr(factor_pipeline, "_ANALYZE_CACHE", {})
+        return calls
+
+    def test_hit_ignores_order_and_duplicates(self, calls):
+        from factor_pipeline import analyze_all_cached
+        first, _, _ = analyze_all_cached(["AAA", "BBB"])
+        first["AAA"]["beta_mkt"] = 99.0             # callers get their own dicts
+        second, _, _ = analyze_all_cached(["BBB", "AAA", "AAA"])
+        assert calls == [["AAA", "BBB"]]
+        assert "beta_mkt" not in second["AAA"]
+
+    def test_entries_expire_after_ttl(self, calls, monkeypatch):
+        import factor_pipeline
+        monkeypatch.setattr(factor_pipeline, "ANALYZE_CACHE_SECONDS", 0)
+        factor_pipeline.analyze_all_cached(["AAA"])
+        factor_pipeline.analyze_all_cached(["AAA"])
+        assert calls == [["AAA"], ["AAA"]]
+
+    def test_oldest_entry_evicted_first(self, calls, monkeypatch):
+        import factor_pipeline
+        monkeypatch.setattr(factor_pipeline, "ANALYZE_CACHE_SIZE", 2)
+        for t in ["AAA", "BBB", "CCC"]:
+            factor_pipeline.analyze_all_cached([t])
+        assert [k[0] for k in factor_pipeline._ANALYZE_CACHE] == [("BBB",), ("CCC",)]
+        factor_pipeline.analyze_all_cached(["BBB"])
+        factor_pipeline.analyze_all_cached(["AAA"])
+        assert calls == [["AAA"], ["BBB"], ["CCC"], ["AAA"]]
+
+    def test_partial_failure_is_not_cached(self, calls):
+        from factor_pipeline import analyze_all_cached
+        analyze_all_cached(["AAA", "BAD"])
+        analyze_all_cached(["AAA", "BAD"])
+        analyze_all_cached(["BAD"])
+        analyze_all_cached(["BAD"])
+        assert len(calls) == 4
+
+
 class TestVarianceDecomposition:
     """Test that variance decomposition math is correct."""
 
-    def test_decomposition_sums_to_100(self):
+    def test_decomposition_sums_to_100(self, aapl_msft_analysis):
         """Factor percentages should sum to approximately 100%."""
-        from factor_pipeline import analyze_all
         from decomposition import compute_factor_covariance, decompose_portfolio_variance
 
         tickers = ["AAPL", "MSFT"]
-        results, ff_df, prices = analyze_all(tickers)
+        results, ff_df, prices = aapl_msft_analysis
 
         factor_cov = compute_factor_covariance(ff_df)
         weights = {"AAPL": 0.6, "MSFT": 0.4}
@@ -100,12 +263,10 @@ class TestVarianceDecomposition:
         )
         assert abs(total - 100.0) < 1.0, f"Decomposition sums to {total:.1f}%, should be ~100%"
 
-    def test_annual_vol_positive(self):
-        from factor_pipeline import analyze_all
+    def test_annual_vol_positive(self, aapl_analysis):
         from decomposition import compute_factor_covariance, decompose_portfolio_variance
 
-        tickers = ["AAPL"]
-        results, ff_df, prices = analyze_all(tickers)
+        results, ff_df, prices = aapl_analysis
 
         factor_cov = compute_factor_covariance(ff_df)
         weights = {"AAPL": 1.0}
@@ -115,13 +276,11 @@ class TestVarianceDecomposition:
         assert decomp["total_annual_vol"] > 0, "Annual vol should be positive"
         assert decomp["total_annual_vol"] < 200, "Annual vol should be < 200%"
 
-    def test_cross_factor_pct_returned(self):
+    def test_cross_factor_pct_returned(self, aapl_analysis):
         """Should return cross_factor_pct key."""
-        from factor_pipeline import analyze_all
         from decomposition import compute_factor_covariance, decompose_portfolio_variance
 
-        tickers = ["AAPL"]
-        results, ff_df, prices = analyze_all(tickers)
+        results, ff_df, prices = aapl_analysis
 
         factor_cov = compute_factor_covariance(ff_df)
         weights = {"AAPL": 1.0}
@@ -130,6 +289,105 @@ class TestVarianceDecomposition:
         decomp = decompose_portfolio_variance(weights, results, factor_cov, residual_vars)
         assert "cross_factor_pct" in decomp, "Should return cross_factor_pct"
 
+    def test_factor_covariance_not_reused_across_frames(self):
+        """Offline: same-shaped FF frames with different data get their own covariance,
+        even when a collected frame's id() is reused."""
+        import numpy as np
+        import pandas as pd
+        from decomposition import compute_factor_covariance
+
+        dates = pd.bdate_range("2023-01-02", periods=300)
+        data = [np.random.default_rng(i).normal(0, 0.01 * (i + 1), (300, 4)) for i in range(4)]
+        expected = [np.cov(x[-252:, :3], rowvar=False) for x in data]
+
+        # Each frame is dropped right after use, so CPython typically hands the
+        # next one the same id(); only the data differs
+        for x, cov in zip(data, expected):
+            ff_df = pd.DataFrame(x, index=dates, columns=["Mkt-RF", "SMB", "HML", "RF"])
+            assert np.allclose(compute_factor_covariance(ff_df), cov)
+            del ff_df
+
+    def test_factor_buckets_match_stock_contributions(self):
+        """With uncorrelated factors, each factor bucket is the sum of its per-stock contributions."""
+        import numpy as np
+        from decomposition import decompose_portfolio_variance
+
+        weights = {"AAA": 0.5, "BBB": 0.3, "CCC": 0.2}
+        betas = {
+            "AAA": {"beta_mkt": 1.2, "beta_smb": 0.4, "beta_hml": -0.3},
+            "BBB": {"beta_mkt": 0.8, "beta_smb": -0.2, "beta_hml": 0.5},
+            "CCC": {"beta_mkt": 1.0, "beta_smb": 0.6, "beta_hml": 0.1},
+        }
+        factor_cov = np.diag([1e-4, 4e-5, 3e-5])
+        residual_vars = {"AAA": 2e-4, "BBB": 1e-4, "CCC": 3e-4}
+
+        decomp = decompose_portfolio_variance(weights, betas, factor_cov, residual_vars)
+        sc = decomp["stock_contributions"]
+
+        # No real cross terms with a diagonal F: rounding noise must not leak
+        # into the buckets or show up as a signed zero
+        assert decomp["cross_factor_pct"] == 0.0
+        assert np.copysign(1.0, decomp["cross_factor_pct"]) == 1.0
+        for bucket, key in [("market_pct", "market_contribution"),
+                            ("idiosyncratic_pct", "idio_contribution")]:
+            stock_sum = sum(c[key] for c in sc.values())
+            assert abs(decomp[bucket] - stock_sum) < 0.01, f"{bucket}={decomp[bucket]} vs {stock_sum}"
+
+
+class TestUploadCsv:
+    """Test CSV parsing in /api/upload-csv (offline, in-memory files)."""
+
+    def _upload(self, text: str):
+        from fastapi.testclient import TestClient
+        from main import app
+        files = {"file": ("holdings.csv", text.encode("utf-8"), "text/csv")}
+        return TestClient(app).post("/api/upload-csv", files=files)
+
+    def test_market_value_cleaning_and_qty_price_fallback(self):
+        csv_text = (
+            "\ufeffSymbol , Quantity,Current Price,Market Value\n"
+            'AAPL,10,150.5,"$1,234.50"\n'   # currency-formatted market value
+            'shop.to ,"1,000",$2.25,\n'     # no market value → qty × price
+            ",1,1,100\n"                     # blank symbol
+            "ZERO,1,1,0\n"                   # non-positive value
+            "NEG,1,1,-5\n"
+            "NA,2,3,\n"                      # "NA" is a ticker, not a missing value
+        )
+        resp = self._upload(csv_text)
+        assert resp.status_code == 200
+        assert resp.json()["positions"] == [
+            {"symbol": "AAPL", "market_value": 1234.5},
+            {"symbol": "SHOP.TO", "market_value": 2250.0},
+            {"symbol": "NA", "market_value": 6.0},
+        ]
+
+    def test_malformed_rows_and_duplicate_headers(self):
+        csv_text = (
+            "Ticker,Value,Value\n"           # duplicate header: last column wins
+            "AAA,1,10\n"
+            "BBB,1,inf\n"                    # non-finite value dropped
+            "CCC,1,5,$1,000\n"              # more fields than the header: skipped
+        )
+        resp = self._upload(csv_text)
+        assert resp.status_code == 200
+        assert resp.json()["positions"] == [{"symbol": "AAA", "market_value": 10.0}]
+
+    def test_trailing_comma_rows_are_kept(self):
+        resp = self._upload("Symbol,Market Value\nAAPL,100,\nMSFT,200,\n")
+        assert resp.status_code == 200
+        assert resp.json()["positions"] == [
+            {"symbol": "AAPL", "market_value": 100.0},
+            {"symbol": "MSFT", "market_value": 200.0},
+        ]
+
+        resp = self._upload("Symbol,Market Value\nAAPL,1,$1,000\n")
+        assert resp.status_code == 400
+        assert "more fields than the header" in resp.json()["detail"]
+
+    def test_no_valid_positions_is_400(self):
+        assert self._upload("Symbol,Market Value\n,5\nX,0\n").status_code == 400
+        assert self._upload("").status_code == 400
+
 
 class TestInsight:
     """Test insight generation."""
@@ -144,7 +402,7 @@ class TestInsight:
             "total_annual_vol": 20.0,
             "stock_contributions": {},
         }
-        insight = generate_insight(decomp, [])
+        insight = generate_insight(decomp)
         assert "market" in insight.lower(), "Should mention market exposure"
         assert len(insight) > 20, "Insight should be a full sentence"
 
@@ -158,7 +416,7 @@ class TestInsight:
             "total_annual_vol": 25.0,
             "stock_contributions": {},
         }
-        insight = generate_insight(decomp, [])
+        insight = generate_insight(decomp)
         assert "small" in insight.lower() or "smb" in insight.lower() or "size" in insight.lower()
 
 